@@ -1,82 +1,106 @@
-from time import sleep
+from typing import Any, Dict, Iterable, Sequence
 
-from selenium.common.exceptions import StaleElementReferenceException, TimeoutException
-from selenium.webdriver import Firefox, FirefoxProfile
+from selenium.common.exceptions import JavascriptException, StaleElementReferenceException
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver import Firefox
+from selenium.webdriver.common.by import By
 from selenium.webdriver.firefox.options import Options
 from selenium.webdriver.remote.webdriver import WebDriver, WebElement
+from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.support.ui import WebDriverWait
 
 
+# the in-page waits end themselves at their own deadline, the script timeout
+# of the session only has to be longer than any of them, in seconds
+SCRIPT_TIMEOUT = 3600
+
+# the rules of WebElement.is_displayed(): an element is hidden when it takes
+# up no space, when its visibility is hidden or collapse (which is inherited)
+# or when it or any of its ancestors is fully transparent
+IS_DISPLAYED_SCRIPT = """
+    function isDisplayed(element) {
+        if (!(element.offsetWidth || element.offsetHeight || element.getClientRects().length)) {
+            return false;
+        }
+        var visibility = window.getComputedStyle(element).visibility;
+        if (visibility === "hidden" || visibility === "collapse") {
+            return false;
+        }
+        for (var node = element; node !== null; node = node.parentElement) {
+            if (window.getComputedStyle(node).opacity === "0") {
+                return false;
+            }
+        }
+        return true;
+    }
+"""
+
+
 def create_driver(debug: bool) -> WebDriver:
     firefox_options = Options()
     if not debug:
         firefox_options.add_argument("-headless")
     # disable navigator.webdriver in order to make driver automation
     # undetectable: https://stackoverflow.com/a/60626696
-    profile = FirefoxProfile()
-    profile.set_preference("dom.webdriver.enabled", False)
-    profile.set_preference("useAutomationExtension", False)
-    profile.update_preferences()
+    firefox_options.set_preference("dom.webdriver.enabled", False)
+    firefox_options.set_preference("useAutomationExtension", False)
     driver = Firefox(
         executable_path="./selenium-drivers/geckodriver",
         options=firefox_options,
-        firefox_profile=profile,
     )
+    driver.set_script_timeout(SCRIPT_TIMEOUT)
     return driver
 
 
-def login(driver: WebDriver, username: str, password: str, timeout: int) -> None:
+def create_wait(driver: WebDriver, timeout: int) -> WebDriverWait:
+    # poll often, most of the awaited elements show up well within the
+    # default half a second interval; elements going stale between being
+    # located and being checked are simply located again
+    return WebDriverWait(
+        driver,
+        timeout,
+        poll_frequency=0.05,
+        ignored_exceptions=[StaleElementReferenceException],
+    )
+
 
-    def find_username_input(driver: WebDriver) -> WebElement:
-        return driver.find_element_by_css_selector("input[name='msisdn']")
-
-    def find_username_submit_button(driver: WebDriver) -> WebElement:
-        return driver.find_element_by_css_selector("button[name='begin']")
-
-    def find_password_input(driver: WebDriver) -> WebElement:
-        return driver.find_element_by_css_selector("input[name='password']")
-
-    def find_password_submit_button(driver: WebDriver) -> WebElement:
-        return driver.find_element_by_css_selector("button[name='openam-pass-submit']")
-
-    def username_form_is_loaded(driver: WebDriver) -> bool:
-        return bool(
-            find_username_input(driver)
-            and find_username_submit_button(driver)
-        )
-
-    def password_form_is_loaded(driver: WebDriver) -> bool:
-        return bool(
-            find_password_input(driver)
-            and find_password_submit_button(driver)
-        )
-
-    def user_profile_is_loaded(driver: WebDriver) -> bool:
-        if driver.current_url != "https://24.play.pl/Play24/Welcome":
-            return False
-        if not find_balance_button(driver):
-            return False
-        for loader in driver.find_elements_by_css_selector(".loader-content"):
-            try:
-                if loader.is_displayed():
-                    return False
-            except StaleElementReferenceException:
-                return False
-        return True
-
-    wait = WebDriverWait(driver, timeout)
+def login(driver: WebDriver, username: str, password: str, timeout: int) -> None:
+    wait = create_wait(driver, timeout)
     driver.get("https://24.play.pl/")
 
-    wait.until(username_form_is_loaded)
-    find_username_input(driver).send_keys(username)
-    sleep(2)
-    find_username_submit_button(driver).click()
+    wait.until(find_username_input).send_keys(username)
+    wait.until(expected_conditions.element_to_be_clickable(
+        (By.CSS_SELECTOR, "button[name='begin']")
+    )).click()
+
+    wait.until(find_password_input).send_keys(password)
+    wait.until(expected_conditions.element_to_be_clickable(
+        (By.CSS_SELECTOR, "button[name='openam-pass-submit']")
+    )).click()
+
+    wait_for_user_profile(driver, timeout)
+
+
+def resume_session(driver: WebDriver, cookies: Iterable[Dict[str, Any]], timeout: int) -> bool:
+    welcome_url = "https://24.play.pl/Play24/Welcome"
+    try:
+        add_session_cookies(driver, cookies)
+    except WebDriverException:
+        # a cookie rejected by the browser, the password login still works
+        return False
+    driver.get(welcome_url)
+    # an expired session is redirected to the login form
+    if driver.current_url != welcome_url:
+        return False
+    try:
+        wait_for_user_profile(driver, timeout)
+    except TimeoutException:
+        return False
+    return True
 
-    wait.until(password_form_is_loaded)
-    find_password_input(driver).send_keys(password)
-    sleep(2)
-    find_password_submit_button(driver).click()
 
+def wait_for_user_profile(driver: WebDriver, timeout: int) -> None:
+    wait = create_wait(driver, timeout)
     wait.until(user_profile_is_loaded)
     try:
         dismiss_news_modal(driver, timeout)
@@ -85,68 +109,147 @@ def login(driver: WebDriver, username: str, password: str, timeout: int) -> None
 
 
 def dismiss_news_modal(driver: WebDriver, timeout: int) -> None:
+    wait = create_wait(driver, timeout)
+    wait.until(find_dismiss_news_button).click()
 
-    def find_dismiss_news_button(driver: WebDriver) -> WebElement:
-        return driver.find_element_by_css_selector("div#fancybox-content button.fancybox-close")
 
-    wait = WebDriverWait(driver, timeout)
-    wait.until(find_dismiss_news_button)
-    find_dismiss_news_button(driver).click()
+def add_session_cookies(driver: WebDriver, cookies: Iterable[Dict[str, Any]]) -> None:
+    # cookies can only be added for the domain of the loaded page
+    driver.get("https://24.play.pl/favicon.ico")
+    for cookie in cookies:
+        driver.add_cookie(cookie)
 
 
 def read_balance(driver: WebDriver, timeout: int) -> str:
+    find_balance_button(driver).click()
+    wait_in_page(driver, timeout, displayed=["#ballancesModalBox"])
+    balance_html: str = driver.execute_script(
+        'return document.getElementById("ballancesModalBox").innerHTML;'
+    )
+    find_close_balance_modal_button(driver).click()
+    wait_in_page(driver, timeout, hidden=["#ballancesModalBox"])
+    return balance_html
 
-    def find_close_balance_modal_button(driver: WebDriver) -> WebElement:
-        return driver.find_element_by_css_selector("#fancybox-close")
 
-    def find_balance_modal(driver: WebDriver) -> WebElement:
-        return driver.find_element_by_css_selector("#ballancesModalBox")
+def find_username_input(driver: WebDriver) -> WebElement:
+    return driver.find_element_by_css_selector("input[name='msisdn']")
 
-    def balance_modal_is_loaded(driver: WebDriver) -> bool:
-        modal = find_balance_modal(driver)
-        if not modal:
-            return False
-        if modal.is_displayed():
-            return True
-        return False
 
-    wait = WebDriverWait(driver, timeout)
-    find_balance_button(driver).click()
-    wait.until(balance_modal_is_loaded)
-    balance_html: str = find_balance_modal(driver).get_property("innerHTML")
-    find_close_balance_modal_button(driver).click()
-    wait.until(lambda driver: not balance_modal_is_loaded(driver))
-    return balance_html
+def find_password_input(driver: WebDriver) -> WebElement:
+    return driver.find_element_by_css_selector("input[name='password']")
+
+
+def find_dismiss_news_button(driver: WebDriver) -> WebElement:
+    return driver.find_element_by_css_selector("div#fancybox-content button.fancybox-close")
 
 
 def find_balance_button(driver: WebDriver) -> WebElement:
     return driver.find_element_by_css_selector("#accountBallances a")
 
 
+def find_close_balance_modal_button(driver: WebDriver) -> WebElement:
+    return driver.find_element_by_id("fancybox-close")
+
+
+def user_profile_is_loaded(driver: WebDriver) -> bool:
+    return page_is_loaded(driver, "https://24.play.pl/Play24/Welcome", "#accountBallances a")
+
+
+def page_is_loaded(driver: WebDriver, url: str, content_selector: str) -> bool:
+    # one script call instead of a WebDriver command per loader element
+    script = IS_DISPLAYED_SCRIPT + """
+        var url = arguments[0], contentSelector = arguments[1];
+        if (window.location.href !== url) {
+            return false;
+        }
+        if (document.querySelector(contentSelector) === null) {
+            return false;
+        }
+        return Array.from(document.querySelectorAll(".loader-content")).every(function (loader) {
+            return !isDisplayed(loader);
+        });
+    """
+    try:
+        is_loaded: bool = driver.execute_script(script, url, content_selector)
+    except JavascriptException:
+        # the script can run while the previous page is being unloaded
+        return False
+    return is_loaded
+
+
+def wait_in_page(
+        driver: WebDriver,
+        timeout: int,
+        displayed: Sequence[str] = (),
+        hidden: Sequence[str] = (),
+) -> None:
+    # waits until the first element matching each of the displayed selectors
+    # is visible and all elements matching the hidden selectors are not;
+    # instead of polling over WebDriver, the page reports back as soon as a
+    # DOM change makes the condition true, with a periodic check for changes
+    # that are not DOM mutations (e.g. a finished CSS transition); this only
+    # works as long as the page does not navigate away
+    script = IS_DISPLAYED_SCRIPT + """
+        var displayed = arguments[0], hidden = arguments[1], timeout = arguments[2];
+        var callback = arguments[arguments.length - 1];
+        function isReady() {
+            return displayed.every(function (selector) {
+                var element = document.querySelector(selector);
+                return element !== null && isDisplayed(element);
+            }) && hidden.every(function (selector) {
+                return Array.from(document.querySelectorAll(selector)).every(function (element) {
+                    return !isDisplayed(element);
+                });
+            });
+        }
+        if (isReady()) {
+            callback(true);
+            return;
+        }
+        var observer, interval, deadline;
+        function finish(ready) {
+            observer.disconnect();
+            clearInterval(interval);
+            clearTimeout(deadline);
+            callback(ready);
+        }
+        function check() {
+            if (isReady()) {
+                finish(true);
+            }
+        }
+        observer = new MutationObserver(check);
+        observer.observe(document.documentElement, {
+            attributes: true,
+            childList: true,
+            subtree: true,
+        });
+        interval = setInterval(check, 100);
+        deadline = setTimeout(function () {
+            finish(false);
+        }, timeout);
+    """
+    is_ready = driver.execute_async_script(script, list(displayed), list(hidden), timeout * 1000)
+    if not is_ready:
+        raise TimeoutException("page not ready after %d seconds" % timeout)
+
+
 def read_services(driver: WebDriver, timeout: int) -> str:
     services_url = "https://24.play.pl/Play24/Services"
-
-    def services_page_is_loaded(driver: WebDriver) -> bool:
+    if driver.current_url != services_url:
+        driver.get(services_url)
+        # a session that is not logged in is redirected to the login form
         if driver.current_url != services_url:
-            return False
-        for loader in driver.find_elements_by_css_selector(".loader-content"):
-            try:
-                if loader.is_displayed():
-                    return False
-            except StaleElementReferenceException:
-                return False
-        return True
-
-    wait = WebDriverWait(driver, timeout)
-    driver.get(services_url)
-    wait.until(services_page_is_loaded)
-    services_element = driver.find_element_by_css_selector(".container.services")
-    services_html: str = services_element.get_property("innerHTML")
+            raise RuntimeError("not logged in, redirected to %s" % driver.current_url)
+    wait_in_page(driver, timeout, displayed=[".container.services"], hidden=[".loader-content"])
+    services_html: str = driver.execute_script(
+        'return document.querySelector(".container.services").innerHTML;'
+    )
     return services_html
 
 
 def logout(driver: WebDriver, timeout: int) -> None:
-    wait = WebDriverWait(driver, timeout)
+    wait = create_wait(driver, timeout)
     logout_button = driver.find_element_by_xpath("//a[.='Wyloguj']")
     logout_button.click()
     wait.until(lambda driver: "Logowanie" in driver.title)
@@ -1,15 +1,24 @@
 #!/usr/bin/env python3
 
 import os
+import json
 import datetime
-from typing import TypeVar, Callable, Iterable, Mapping, Tuple, Union
+import pathlib
+import unicodedata
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, TypeVar, Callable, Dict, Iterable, List, Mapping, Optional
+from typing import Sequence, Tuple, Union
 
-from lxml import html
+from lxml import etree, html
 
-from browser import create_driver, login, logout, read_balance, read_services
 from value_parsers import parse_balance, parse_date, parse_data_cap, parse_quantity
 from value_parsers import parse_boolean_state
 
+if TYPE_CHECKING:
+    from configparser import ConfigParser
+    from selenium.webdriver.remote.webdriver import WebDriver
+
 
 BalanceValue = Union[str, float, bool, datetime.date]
 BalanceParser = Tuple[str, str, Callable]
@@ -190,80 +199,127 @@ SERVICE_PARSERS: Iterable[ServiceParser] = [
 ]
 
 
+BALANCE_PARSERS_BY_LABEL: Mapping[str, Tuple[str, Callable]] = {
+    unicodedata.normalize("NFC", label): (key, parser)
+    for label, key, parser in BALANCE_PARSERS
+}
+
+SERVICE_PARSERS_BY_LABEL: Mapping[Tuple[str, bool], Tuple[str, Callable]] = {
+    (unicodedata.normalize("NFC", label), flag): (key, parser)
+    for (label, flag), key, parser in SERVICE_PARSERS
+}
+
+
+def has_class(class_name: str) -> str:
+    # matches whole class names only, unlike a plain contains(@class, ...)
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % class_name
+
+
+BALANCE_ROW_XPATH = etree.XPath(
+    "//div[" + has_class("border-apla") + "]"
+    "/div[@class='level']"
+)
+BALANCE_LABEL_XPATH = etree.XPath(
+    "string(./div[" + has_class("level-left") + "])",
+    smart_strings=False,
+)
+BALANCE_VALUE_XPATH = etree.XPath(
+    "string(./div[" + has_class("level-item") + "])",
+    smart_strings=False,
+)
+
+SERVICE_ROW_XPATH = etree.XPath("//div[" + has_class("image-tile") + "]")
+SERVICE_LABEL_XPATH = etree.XPath(
+    "string(.//p[" + has_class("tile-title") + "])",
+    smart_strings=False,
+)
+SERVICE_VALUE_XPATH = etree.XPath(
+    "string(.//div[" + has_class("active-label") + "])",
+    smart_strings=False,
+)
+SERVICE_FLAG_XPATH = etree.XPath(
+    "boolean(.//div[" + has_class("tile-actions") + "]/div[contains(., 'miesi\u0119cznie')])"
+)
+
+# comments, processing instructions and the id index are not used by any
+# of the expressions
+HTML_PARSER = html.HTMLParser(remove_comments=True, remove_pis=True, collect_ids=False)
+
+
 def parse_balance_data(html_code: str) -> Mapping[str, BalanceValue]:
-    row_xpath = (
-        "//div[contains(@class, 'border-apla')]"
-        "/div[@class='level']"
+    parsed = parse_table(
+        html_code,
+        BALANCE_ROW_XPATH,
+        BALANCE_LABEL_XPATH,
+        BALANCE_VALUE_XPATH,
     )
-    label_xpath = "./div[contains(@class, 'level-left')]"
-    value_xpath = "./div[contains(@class, 'level-item')]"
-    parsed = parse_table(html_code, row_xpath, label_xpath, value_xpath)
-    return {
-        key: parser(parsed[label])
-        for label, key, parser in BALANCE_PARSERS if label in parsed
-    }
+    data: Dict[str, BalanceValue] = {}
+    for label, (key, parser) in BALANCE_PARSERS_BY_LABEL.items():
+        value = parsed.get(label)
+        if value is not None:
+            data[key] = parser(value)
+    return data
 
 
 def parse_services_data(html_code: str) -> Mapping[str, bool]:
-    row_xpath = "//div[contains(@class, 'image-tile')]"
-    label_xpath = ".//p[contains(@class, 'tile-title')]"
-    value_xpath = ".//div[contains(@class, 'active-label')]"
-    flag_xpath = ".//div[contains(@class, 'tile-actions')]/div[contains(., 'miesi\u0119cznie')]"
     parsed = parse_flagged_table(
         html_code,
-        row_xpath,
-        label_xpath,
-        value_xpath,
-        flag_xpath
+        SERVICE_ROW_XPATH,
+        SERVICE_LABEL_XPATH,
+        SERVICE_VALUE_XPATH,
+        SERVICE_FLAG_XPATH,
     )
-    return {
-        key: parser(parsed[label])
-        for label, key, parser in SERVICE_PARSERS if label in parsed
-    }
+    data: Dict[str, bool] = {}
+    for label, (key, parser) in SERVICE_PARSERS_BY_LABEL.items():
+        value = parsed.get(label)
+        if value is not None:
+            data[key] = parser(value)
+    return data
 
 
 def parse_table(
         html_code: str,
-        row_xpath: str,
-        label_xpath: str,
-        value_xpath: str,
+        row_xpath: etree.XPath,
+        label_xpath: etree.XPath,
+        value_xpath: etree.XPath,
 ) -> Mapping[str, str]:
+    row_nodes = row_xpath(html.fromstring(html_code, parser=HTML_PARSER))
     return {
-        xpath_text(row_node, label_xpath, False):
-        first_line(xpath_text(row_node, value_xpath, False)).strip()
-        for row_node in html.fromstring(html_code).xpath(row_xpath)
+        xpath_text(row_node, label_xpath):
+        first_line(xpath_text(row_node, value_xpath)).strip()
+        for row_node in row_nodes
     }
 
 
 def parse_flagged_table(
         html_code: str,
-        row_xpath: str,
-        label_xpath: str,
-        value_xpath: str,
-        flag_xpath: str
+        row_xpath: etree.XPath,
+        label_xpath: etree.XPath,
+        value_xpath: etree.XPath,
+        flag_xpath: etree.XPath,
 ) -> Mapping[Tuple[str, bool], str]:
+    row_nodes = row_xpath(html.fromstring(html_code, parser=HTML_PARSER))
     return {
-        (xpath_text(row_node, label_xpath, True), bool(row_node.xpath(flag_xpath))):
-        first_line(xpath_text(row_node, value_xpath, True)).strip()
-        for row_node in html.fromstring(html_code).xpath(row_xpath)
+        (xpath_text(row_node, label_xpath), flag_xpath(row_node)):
+        first_line(xpath_text(row_node, value_xpath)).strip()
+        for row_node in row_nodes
     }
 
 
-def xpath_text(parent_node: html.HtmlElement, xpath: str, allow_empty: bool) -> str:
-    nodes = parent_node.xpath(xpath)
-    if not nodes and allow_empty:
-        return ""
-    return nodes[0].text_content().strip()  # type: ignore
+def xpath_text(parent_node: html.HtmlElement, xpath: etree.XPath) -> str:
+    # labels are matched against the parser tables, so the page text must
+    # use the same Unicode normalization form as the tables
+    return unicodedata.normalize("NFC", xpath(parent_node).strip())
 
 
 def first_line(string: str) -> str:
-    return "" if string == "" else string.splitlines()[0]
+    return string.partition("\n")[0]
 
 
 def config_wanted_keys(
         config_value: str,
         parsers: Union[Iterable[BalanceParser], Iterable[ServiceParser]],
-) -> Iterable[str]:
+) -> Sequence[str]:
     if config_value == "*":
         return [parser[1] for parser in parsers]
     return config_value.split()
@@ -271,14 +327,143 @@ def config_wanted_keys(
 
 def check_and_filter_keys(
         data: ParsedData,
-        wanted_keys: Iterable[str],
+        wanted_keys: Sequence[str],
 ) -> ParsedData:
+    missing_keys = [key for key in wanted_keys if key not in data]
+    if missing_keys:
+        raise ValueError("missing keys: %s" % ", ".join(missing_keys))
     filtered_data = {}
     for key in wanted_keys:
         filtered_data[key] = data[key]
     return filtered_data
 
 
+def session_cookies_path() -> str:
+    cache_dir = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(cache_dir, "24.play.pl.session.json")
+
+
+def load_session_cookies(path: str) -> List[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as session_file:
+            cookies = json.load(session_file)
+    except (OSError, ValueError):
+        return []
+    # a damaged file falls back to logging in, just like a missing one
+    if not isinstance(cookies, list) or not all(isinstance(cookie, dict) for cookie in cookies):
+        return []
+    return cookies
+
+
+def save_session_cookies(path: str, cookies: List[Dict[str, Any]]) -> None:
+    # the cookies give access to the account, just like the password, so the
+    # file must not be readable by others
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # the mode given to os.open only applies to a newly created file
+    os.fchmod(descriptor, 0o600)
+    with open(descriptor, "w", encoding="utf-8") as session_file:
+        json.dump(cookies, session_file)
+
+
+def config_timeout(config: "ConfigParser", option: str) -> int:
+    timeout = config.getint("browser", "timeout", fallback=20)
+    return config.getint("browser", option, fallback=timeout)
+
+
+def start_session(driver: "WebDriver", config: "ConfigParser") -> None:
+    from browser import login, resume_session
+
+    login_timeout = config_timeout(config, "login_timeout")
+    if config.getboolean("browser", "keep_session", fallback=False):
+        cookies = load_session_cookies(session_cookies_path())
+        if cookies and resume_session(driver, cookies, login_timeout):
+            return
+    login(
+        driver,
+        config.get("auth", "login"),
+        config.get("auth", "password"),
+        login_timeout,
+    )
+
+
+def end_session(driver: "WebDriver", config: "ConfigParser") -> None:
+    from browser import logout
+
+    if config.getboolean("browser", "keep_session", fallback=False):
+        save_session_cookies(session_cookies_path(), driver.get_cookies())
+    else:
+        logout(driver, config_timeout(config, "logout_timeout"))
+
+
+def read_page_with_cookies(
+        debug: bool,
+        reader: Callable[["WebDriver", int], str],
+        timeout: int,
+        driver_started: "queue.Queue[bool]",
+        session_cookies: "queue.Queue[Optional[List[Dict[str, Any]]]]",
+) -> str:
+    from browser import add_session_cookies, create_driver
+
+    started = False
+    try:
+        driver = create_driver(debug)
+        started = True
+    finally:
+        # lets the first session give up before logging in
+        driver_started.put(started)
+    try:
+        cookies = session_cookies.get()
+        if cookies is None:
+            raise RuntimeError("no session to share")
+        add_session_cookies(driver, cookies)
+        page_html = reader(driver, timeout)
+    finally:
+        driver.quit()
+    return page_html
+
+
+def read_pages(config: "ConfigParser", debug: bool) -> Tuple[str, str]:
+    from browser import create_driver, read_balance, read_services
+
+    read_timeout = config_timeout(config, "read_timeout")
+    # the services page is read in a second browser session, which starts
+    # while the first one is logging in and then reuses its cookies, so that
+    # the page loads overlap without logging in twice
+    driver_started: "queue.Queue[bool]" = queue.Queue()
+    session_cookies: "queue.Queue[Optional[List[Dict[str, Any]]]]" = queue.Queue()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        services_future = executor.submit(
+            read_page_with_cookies,
+            debug,
+            read_services,
+            read_timeout,
+            driver_started,
+            session_cookies,
+        )
+        try:
+            driver = create_driver(debug)
+            try:
+                if not driver_started.get():
+                    # raises the error of the second session
+                    services_future.result()
+                start_session(driver, config)
+                try:
+                    session_cookies.put(driver.get_cookies())
+                    balance_html = read_balance(driver, read_timeout)
+                    # the session must stay valid until the second one is done
+                    services_html = services_future.result()
+                finally:
+                    end_session(driver, config)
+            finally:
+                driver.quit()
+        finally:
+            # unblocks the second session if logging in failed, otherwise
+            # this is never read
+            session_cookies.put(None)
+    return balance_html, services_html
+
+
 def main() -> None:
     import configparser
     import argparse
@@ -300,16 +485,10 @@ def main() -> None:
     config = configparser.ConfigParser()
     config.read(os.path.join(config_dir, "24.play.pl.ini"))
 
-    timeout = config.getint("browser", "timeout", fallback=20)
-    driver = create_driver(args.debug)
-    login(driver, config.get("auth", "login"), config.get("auth", "password"), timeout)
-    balance_html = read_balance(driver, timeout)
-    services_html = read_services(driver, timeout)
+    balance_html, services_html = read_pages(config, args.debug)
     if args.keep:
-        open("balance.html", "w").write(balance_html)
-        open("services.html", "w").write(services_html)
-    logout(driver, timeout)
-    driver.quit()
+        pathlib.Path("balance.html").write_text(balance_html, encoding="utf-8")
+        pathlib.Path("services.html").write_text(services_html, encoding="utf-8")
     balance_data = parse_balance_data(balance_html)
     services_data = parse_services_data(services_html)
 
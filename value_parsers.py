@@ -1,46 +1,58 @@
 import re
 import datetime
-from typing import Match
+from typing import Optional
+
+
+BALANCE_PATTERN = re.compile("(?P<int>[0-9]+)(,(?P<fract>[0-9]{2})){0,1} z\u0142")
+DATA_CAP_PATTERN = re.compile("(?P<int>[0-9]+)(,(?P<fract>[0-9]+)){0,1} (?P<unit>GB|MB)")
+
+BOOLEAN_STATES = {
+    "": False,
+    "W\u0142\u0105czony": True,
+}
 
 
 def parse_balance(balance_str: str) -> float:
-    match = re.search("^(?P<int>[0-9]+)(,(?P<fract>[0-9]{2})){0,1} z\u0142", balance_str)
+    match = BALANCE_PATTERN.match(balance_str)
     if not match:
         raise ValueError("invalid balance: %s" % balance_str)
-    return parse_float(match)
+    return parse_float(match.group("int"), match.group("fract"))
 
 
 def parse_date(date_str: str) -> datetime.date:
+    # the usual zero-padded "DD.MM.YYYY" form is sliced directly, strptime
+    # handles everything else
+    day, month, year = date_str[0:2], date_str[3:5], date_str[6:]
+    digits = day + month + year
+    is_padded = date_str[2:3] == date_str[5:6] == "." and len(digits) == 8
+    if is_padded and digits.isascii() and digits.isdigit():
+        return datetime.date(int(year), int(month), int(day))
     return datetime.datetime.strptime(date_str, "%d.%m.%Y").date()
 
 
 def parse_data_cap(cap_str: str) -> float:
-    match = re.search("^(?P<int>[0-9]+)(,(?P<fract>[0-9]+)){0,1} (?P<unit>GB|MB)", cap_str)
+    match = DATA_CAP_PATTERN.match(cap_str)
     if not match:
         raise ValueError("invalid data cap: %s" % cap_str)
-    value = parse_float(match)
+    value = parse_float(match.group("int"), match.group("fract"))
     if match.group("unit") == "MB":
         value /= 1000
     return value
 
 
 def parse_quantity(quantity_str: str) -> int:
-    match = re.search(r"^(?P<int>[0-9]+) (?P<unit>szt\.)", quantity_str)
-    if not match:
+    quantity, unit, _ = quantity_str.partition(" szt.")
+    if not unit or not (quantity.isascii() and quantity.isdigit()):
         raise ValueError("invalid quantity: %s" % quantity_str)
-    return int(match.group("int"))
+    return int(quantity)
 
 
-def parse_float(re_match: Match) -> float:
-    value = float(re_match.group("int"))
-    if re_match.group("fract") is not None:
-        value += float("." + re_match.group("fract"))
+def parse_float(integer_part: str, fractional_part: Optional[str]) -> float:
+    value = float(integer_part)
+    if fractional_part is not None:
+        value += int(fractional_part) / 10 ** len(fractional_part)
     return value
 
 
 def parse_boolean_state(state: str) -> bool:
-    value_map = {
-        "": False,
-        "W\u0142\u0105czony": True,
-    }
-    return value_map[state]
+    return BOOLEAN_STATES[state]